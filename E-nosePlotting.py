@@ -1,21 +1,99 @@
+import time
+
+STARTUP_T0 = time.perf_counter()  # 冷启动计时起点
+STARTUP_PHASES = []  # (阶段名, 结束时刻), 供 --profile-startup 打印分阶段耗时
+
+
+def mark_startup_phase(name):
+    STARTUP_PHASES.append((name, time.perf_counter()))
+
+
 import dash
 from dash import dcc, html, callback_context, no_update
 from dash.dependencies import Input, Output, State
-import pandas as pd
+import flask
+
+mark_startup_phase('导入 dash / flask')
 import plotly.graph_objs as go
-import plotly.express as px
+import numpy as np
+
+mark_startup_phase('导入 plotly.graph_objs / numpy')
 import base64
 import io
 import os
-import numpy as np
 import sys
+import socket
 import webbrowser
 import threading
 import copy
+import tempfile
+import hashlib
+import json
+import gzip
+import re
+import shutil
+import uuid
+import warnings
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # 运行时不执行; 让 PyInstaller 能扫描到下面按名称延迟导入/预热的模块
+    import pandas
+    import plotly.express
+    import scipy.interpolate
+    import scipy.signal
+    import sklearn.preprocessing
+    import sklearn.decomposition
+    import sklearn.discriminant_analysis
+    import sklearn.manifold
+    import sklearn.svm
+
+mark_startup_phase('导入标准库模块')
+
+
+# --- 延迟导入 (缩短冷启动时间) ---
+# pandas / plotly.express 在首次使用时才导入; scikit-learn 与 scipy 在各函数内部导入,
+# 并在切换到分析标签页时于后台线程预热
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = LazyModule('pandas')
+px = LazyModule('plotly.express')
+
+DATA_STACK_MODULES = ['pandas', 'plotly.express']
+ML_STACK_MODULES = ['scipy.interpolate', 'scipy.signal', 'sklearn.preprocessing', 'sklearn.decomposition',
+                    'sklearn.discriminant_analysis', 'sklearn.manifold', 'sklearn.svm']
+COLD_START_TARGET_S = 3.0  # 从启动到服务可访问的目标耗时
+prewarmed_module_groups = set()
+prewarm_lock = threading.Lock()
+
+
+def prewarm_modules(group, modules, background=True):
+    with prewarm_lock:
+        if group in prewarmed_module_groups: return
+        prewarmed_module_groups.add(group)
+
+    def load():
+        for name in modules:
+            importlib.import_module(name)
+
+    if background:
+        threading.Thread(target=load, name=f'prewarm-{group}', daemon=True).start()
+    else:
+        load()
 
-from sklearn.preprocessing import StandardScaler, MinMaxScaler, LabelEncoder
-from sklearn.decomposition import PCA
-from sklearn.svm import SVC
 
 # --- PyInstaller 路径处理 ---
 if getattr(sys, 'frozen', False):
@@ -33,10 +111,781 @@ def generate_distinct_colors(n):
     return colors
 
 
+# --- 结果缓存 (按内容哈希索引; 单进程用内存 LRU, 多 worker 部署时共享 diskcache 目录) ---
+CACHE_DIR_ENV = 'ENOSE_CACHE_DIR'
+
+result_caches = []
+
+
+class LRUCache:
+    def __init__(self, maxsize=32, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data: return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.max_bytes is not None:
+                self._sizes[key] = self.sizeof(value)
+            # 按条目数淘汰; 设置了 max_bytes 时还按总字节数淘汰, 但至少保留最新的一项
+            while len(self._data) > self.maxsize or (
+                    self.max_bytes is not None and len(self._data) > 1 and sum(self._sizes.values()) > self.max_bytes):
+                old_key, _ = self._data.popitem(last=False)
+                self._sizes.pop(old_key, None)
+
+
+class DiskCache:
+    def __init__(self, directory, name, size_limit=2 ** 30):
+        self.path = os.path.join(directory, name)
+        self.size_limit = size_limit
+        self._cache = None
+        self._pid = None
+
+    def _handle(self):
+        # 每个 worker 进程各自打开连接, 不复用 fork 前的 SQLite 句柄
+        if self._pid != os.getpid():
+            import diskcache
+            self._cache = diskcache.Cache(self.path, size_limit=self.size_limit)
+            self._pid = os.getpid()
+        return self._cache
+
+    def get(self, key, default=None):
+        return self._handle().get(key, default)
+
+    def set(self, key, value):
+        self._handle().set(key, value)
+
+
+class ResultCache:
+    def __init__(self, name, maxsize, max_bytes=None, sizeof=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.backend = LRUCache(maxsize, max_bytes, sizeof)
+        result_caches.append(self)
+
+    def get(self, key, default=None):
+        return self.backend.get(key, default)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+
+def configure_shared_cache(directory):
+    if importlib.util.find_spec('diskcache') is None:
+        print(f"diskcache 未安装, 缓存仅在各 worker 进程内有效 ({directory} 未启用)")
+        return
+    os.makedirs(directory, exist_ok=True)
+    for cache in result_caches:
+        cache.backend = DiskCache(directory, cache.name, size_limit=cache.max_bytes or 2 ** 30)
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True).sum())
+
+
+FRAME_CACHE_BYTES = 512 * 2 ** 20  # 每次校准/预处理都会产生新的 processed JSON, 因此按内存占用封顶
+
+frame_cache = ResultCache('frames', maxsize=16, max_bytes=FRAME_CACHE_BYTES, sizeof=frame_nbytes)
+
+
+def read_frame(json_str):
+    # 上传的数据在 dcc.Store 中以 JSON 保存; 按内容哈希缓存解析结果, 同一文件只解析一次
+    key = hashlib.sha1(json_str.encode('utf-8')).hexdigest()
+    df = frame_cache.get(key)
+    if df is None:
+        df = pd.read_json(json_str, orient='split')
+        frame_cache.set(key, df)
+    return df
+
+
+def hash_arrays(*arrays):
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype}{a.shape}".encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+# --- 投影引擎 (PCA / 随机化 PCA / LDA / t-SNE / UMAP) ---
+PROJECTION_METHODS = {
+    'pca': {'label': '完整 PCA', 'title': 'PCA', 'prefix': 'PC'},
+    'randomized_pca': {'label': '随机化 PCA (大样本)', 'title': '随机化 PCA', 'prefix': 'PC'},
+    'lda': {'label': 'LDA (有监督)', 'title': 'LDA', 'prefix': 'LD'},
+    'tsne': {'label': 't-SNE (非线性)', 'title': 't-SNE', 'prefix': 'tSNE'},
+}
+# UMAP 为可选依赖, 仅在已安装时提供
+if importlib.util.find_spec('umap') is not None:
+    PROJECTION_METHODS['umap'] = {'label': 'UMAP (非线性)', 'title': 'UMAP', 'prefix': 'UMAP'}
+
+projection_cache = ResultCache('projection', maxsize=32)
+
+
+def scale_features(X, scaling_method):
+    from sklearn.preprocessing import StandardScaler, MinMaxScaler
+    scaler = StandardScaler() if scaling_method == 'standard' else MinMaxScaler()
+    X_scaled = scaler.fit_transform(X)
+    if scaling_method == 'standard':
+        params = {'type': 'standard', 'mean': scaler.mean_.tolist(), 'scale': scaler.scale_.tolist()}
+    else:
+        params = {'type': 'minmax', 'data_min': scaler.data_min_.tolist(), 'data_max': scaler.data_max_.tolist()}
+    return X_scaled, params
+
+
+def compute_projection(X, y_encoded, scaling_method, method, n_components, random_state=0):
+    # 结果按 (数据哈希, 方法, 参数) 缓存; 重复绘图/下载不会重新拟合
+    key = (hash_arrays(X, y_encoded), scaling_method, method, n_components, random_state)
+    cached = projection_cache.get(key)
+    if cached is not None: return cached
+    from sklearn.decomposition import PCA
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+    from sklearn.manifold import TSNE
+
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"不支持的投影方法: {method}")
+    n_samples, n_features = X.shape
+    if n_features < n_components:
+        raise ValueError(f"传感器数量 ({n_features}) 少于目标维度 ({n_components})")
+    if n_samples < n_components:
+        raise ValueError(f"请标记至少 {n_components} 个数据点以进行 {n_components}D 投影")
+
+    X_scaled, scaler_params = scale_features(X, scaling_method)
+    model_params = {'method': method, 'n_components': n_components}
+    explained = None
+
+    if method == 'pca':
+        # 一次性求出全部主成分, 碎石图直接取自同一次拟合
+        model = PCA(n_components=min(n_samples, n_features))
+        embedding = model.fit_transform(X_scaled)[:, :n_components]
+        explained = model.explained_variance_ratio_
+        model_params.update(components=model.components_[:n_components].tolist(), mean=model.mean_.tolist())
+    elif method == 'randomized_pca':
+        model = PCA(n_components=n_components, svd_solver='randomized', random_state=random_state)
+        embedding = model.fit_transform(X_scaled)
+        explained = model.explained_variance_ratio_
+        model_params.update(components=model.components_.tolist(), mean=model.mean_.tolist())
+    elif method == 'lda':
+        max_dims = min(len(np.unique(y_encoded)) - 1, n_features)
+        if n_components > max_dims:
+            raise ValueError(f"LDA 最多只能降至 {max_dims} 维 (类别数 - 1), 请增加标签类别或降低维度")
+        model = LinearDiscriminantAnalysis(n_components=n_components)
+        embedding = model.fit_transform(X_scaled, y_encoded)
+        explained = model.explained_variance_ratio_
+        model_params.update(scalings=model.scalings_[:, :n_components].tolist(), xbar=model.xbar_.tolist())
+    elif method == 'tsne':
+        perplexity = max(1.0, min(30.0, (n_samples - 1) / 3))
+        model = TSNE(n_components=n_components, perplexity=perplexity, init='pca', random_state=random_state,
+                     n_jobs=-1)
+        embedding = model.fit_transform(X_scaled)
+        model_params.update(perplexity=perplexity)
+    else:
+        import umap
+        n_neighbors = max(2, min(15, n_samples - 1))
+        # 不固定 random_state, 否则 UMAP 会退化为单线程
+        model = umap.UMAP(n_components=n_components, n_neighbors=n_neighbors, n_jobs=-1)
+        embedding = model.fit_transform(X_scaled)
+        model_params.update(n_neighbors=n_neighbors)
+
+    result = {
+        'embedding': np.asarray(embedding),
+        'explained_variance_ratio': None if explained is None else np.asarray(explained),
+        'params': {'scaler': scaler_params, 'projection': model_params},
+    }
+    projection_cache.set(key, result)
+    return result
+
+
+def projection_axis_labels(method, explained, n_components, verbose=False):
+    prefix = PROJECTION_METHODS[method]['prefix']
+    labels = {}
+    for i in range(n_components):
+        if method in ('pca', 'randomized_pca') and verbose:
+            name = f'主成分 {i + 1}'
+        else:
+            name = f'{prefix}{i + 1}'
+        labels[f'PC{i + 1}'] = f'{name} ({explained[i]:.1%})' if explained is not None else name
+    return labels
+
+
+def format_scree_info(method, explained):
+    if explained is None:
+        return f"{PROJECTION_METHODS[method]['title']} 为非线性嵌入, 无解释方差。"
+    prefix = PROJECTION_METHODS[method]['prefix']
+    parts = [f"{prefix}{i + 1}: {r:.1%}" for i, r in enumerate(explained)]
+    return "解释方差: " + " | ".join(parts) + f"\n累计: {np.sum(explained):.1%}"
+
+
+# --- 大样本散点渲染 ---
+WEBGL_POINT_THRESHOLD = 1000  # 超过该点数时 2D 散点改用 WebGL (Scattergl)
+DENSITY_POINT_THRESHOLD = 50000  # '自动' 模式下超过该点数时改为服务端密度图
+DENSITY_BINS = 200
+
+
+def subsample_per_class(y_encoded, max_per_class, seed=0):
+    # 按类别抽样, 仅用于显示; 返回排序后的行索引
+    rng = np.random.default_rng(seed)
+    keep = []
+    for cls in np.unique(y_encoded):
+        idx = np.flatnonzero(y_encoded == cls)
+        if len(idx) > max_per_class:
+            idx = rng.choice(idx, size=max_per_class, replace=False)
+        keep.append(idx)
+    return np.sort(np.concatenate(keep))
+
+
+def build_density_traces(X_2d, labels, color_map, bins=DENSITY_BINS):
+    # 在服务端做二维直方图, 浏览器只需渲染 bins x bins 的网格
+    counts, x_edges, y_edges = np.histogram2d(X_2d[:, 0], X_2d[:, 1], bins=bins)
+    z = np.log1p(counts.T)
+    z[counts.T == 0] = np.nan
+    traces = [go.Heatmap(x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=z,
+                         colorscale='Blues', showscale=False, name='样本密度', hoverinfo='skip')]
+    labels = np.asarray(labels)
+    for label, color in color_map.items():
+        center = X_2d[labels == label].mean(axis=0)
+        traces.append(go.Scatter(x=[center[0]], y=[center[1]], mode='markers+text', name=str(label),
+                                 text=[str(label)], textposition='top center',
+                                 marker=dict(size=14, symbol='x', color=color,
+                                             line=dict(width=1, color='DarkSlateGrey'))))
+    return traces
+
+
+# --- SVM 决策区域 (3D 体渲染) ---
+SVM_VOLUME_TIME_BUDGET_S = 2.0  # 网格评估的时间预算, 决定网格分辨率
+SVM_VOLUME_MIN_RES, SVM_VOLUME_MAX_RES = 12, 60
+SVM_VOLUME_MAX_CLASS_POINTS = 400000  # 网格点数 x 类别数的上限, 限制表面提取与传输的数据量
+SVM_PREDICT_CHUNK = 50000
+SVM_MESH_2D_RES = 300  # 2D 决策边界网格每个坐标轴的点数
+# 安装 scikit-image 时用 marching cubes 提取平滑表面, 否则使用体素边界面
+SKIMAGE_AVAILABLE = importlib.util.find_spec('skimage') is not None
+
+svm_volume_cache = ResultCache('svm_volume', maxsize=8)
+
+
+def parse_svm_gamma(svm_gamma):
+    try:
+        return float(svm_gamma)
+    except (ValueError, TypeError):
+        return svm_gamma
+
+
+def predict_in_chunks(model, points, chunk_size=SVM_PREDICT_CHUNK):
+    out = np.empty(len(points), dtype=int)
+    for start in range(0, len(points), chunk_size):
+        out[start:start + chunk_size] = model.predict(points[start:start + chunk_size])
+    return out
+
+
+def extract_region_surface(mask, axes):
+    # 在服务端提取某一类别区域的闭合表面, 返回 float32 顶点和 int32 三角面
+    padded = np.pad(mask, 1)
+    steps = [a[1] - a[0] for a in axes]
+    if SKIMAGE_AVAILABLE:
+        from skimage.measure import marching_cubes
+        verts, faces, _, _ = marching_cubes(padded.astype(np.float32), level=0.5, spacing=tuple(steps))
+        verts += [a[0] - step for a, step in zip(axes, steps)]
+        return verts.astype(np.float32), faces.astype(np.int32)
+
+    # 相邻网格点分属区域内外时, 在两者之间放一个正方形面 (两个三角形)
+    edges = [np.concatenate([[a[0] - step / 2], (a[:-1] + a[1:]) / 2, [a[-1] + step / 2]])
+             for a, step in zip(axes, steps)]
+    quads = []
+    for axis in range(3):
+        u, v = [d for d in range(3) if d != axis]
+        crop = [slice(1, -1)] * 3
+        crop[axis] = slice(None)
+        base = np.column_stack(np.nonzero(np.diff(padded.astype(np.int8), axis=axis)[tuple(crop)]))
+        corners = []
+        for du, dv in ((0, 0), (1, 0), (1, 1), (0, 1)):
+            corner = base.copy()
+            corner[:, u] += du
+            corner[:, v] += dv
+            corners.append(corner)
+        quads.append(np.stack(corners, axis=1))
+    quads = np.concatenate(quads)
+    shape = tuple(len(e) for e in edges)
+    ids = np.ravel_multi_index(tuple(quads.reshape(-1, 3).T), shape)
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    lattice = np.unravel_index(unique_ids, shape)
+    verts = np.column_stack([edges[d][lattice[d]] for d in range(3)]).astype(np.float32)
+    quads = inverse.reshape(-1, 4)
+    return verts, np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]]).astype(np.int32)
+
+
+def compute_svm_volume(X_3d, y_encoded, kernel, C, gamma, degree, time_budget=SVM_VOLUME_TIME_BUDGET_S):
+    # 按 (数据哈希, 模型参数) 缓存拟合好的模型和各类别的决策区域表面
+    key = (hash_arrays(X_3d, y_encoded), kernel, C, gamma, degree, time_budget)
+    cached = svm_volume_cache.get(key)
+    if cached is not None: return cached
+    from sklearn.svm import SVC
+
+    model = SVC(kernel=kernel, C=C, gamma=gamma, degree=degree).fit(X_3d, y_encoded)
+    lo, hi = X_3d.min(axis=0) - 1, X_3d.max(axis=0) + 1
+
+    # 先用一小批探测点测出预测吞吐量, 再在时间预算内选择网格分辨率;
+    # 每个类别都要提取一次表面, 因此总点数还按类别数封顶
+    probe = np.random.default_rng(0).uniform(lo, hi, size=(2000, 3))
+    t0 = time.perf_counter()
+    model.predict(probe)
+    rate = len(probe) / max(time.perf_counter() - t0, 1e-6)
+    n_classes = len(np.unique(y_encoded))
+    res = min((rate * time_budget) ** (1 / 3), (SVM_VOLUME_MAX_CLASS_POINTS / n_classes) ** (1 / 3))
+    res = int(np.clip(res, SVM_VOLUME_MIN_RES, SVM_VOLUME_MAX_RES))
+
+    axes = [np.linspace(lo[i], hi[i], res) for i in range(3)]
+    gx, gy, gz = np.meshgrid(*axes, indexing='ij')
+    Z = predict_in_chunks(model, np.column_stack([gx.ravel(), gy.ravel(), gz.ravel()])).reshape(gx.shape)
+    surfaces = {int(cls): extract_region_surface(Z == cls, axes) for cls in np.unique(Z)}
+    result = {'model': model, 'surfaces': surfaces, 'resolution': res}
+    svm_volume_cache.set(key, result)
+    return result
+
+
+def build_svm_volume_traces(volume, unique_labels, color_sequence):
+    # 每个类别一个 Mesh3d, 只传输顶点和三角面, 浏览器无需重新计算等值面
+    traces = []
+    for cls, (verts, faces) in volume['surfaces'].items():
+        if len(faces) == 0: continue
+        traces.append(go.Mesh3d(x=verts[:, 0], y=verts[:, 1], z=verts[:, 2], i=faces[:, 0], j=faces[:, 1],
+                                k=faces[:, 2], color=color_sequence[cls % len(color_sequence)], opacity=0.25,
+                                flatshading=True, name=f'SVM 区域: {unique_labels[cls]}', hoverinfo='skip'))
+    return traces
+
+
+# --- 传感器数据预处理流水线 (在基线校准之前执行) ---
+PREPROCESS_ORDER = ['interpolate', 'hampel', 'resample', 'smooth']
+PREPROCESS_CHUNK_ROWS = 200000  # 长文件按行分块处理
+PREPROCESS_CACHE_BYTES = 512 * 2 ** 20  # 中间结果缓存按 DataFrame 占用的内存封顶
+PREPROCESS_STEP_NAMES = {'interpolate': '插值', 'hampel': 'Hampel', 'resample': '重采样', 'smooth': '平滑'}
+
+preprocess_cache = ResultCache('preprocess', maxsize=64, max_bytes=PREPROCESS_CACHE_BYTES, sizeof=frame_nbytes)
+
+
+def apply_chunked(values, func, halo, chunk_rows=PREPROCESS_CHUNK_ROWS):
+    # 每块两端带 halo 行重叠, 只要 halo 不小于滑动窗口, 结果与整体处理一致
+    n = len(values)
+    if n <= chunk_rows: return func(values)
+    out = np.empty(values.shape, dtype=float)
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        lo, hi = max(0, start - halo), min(n, stop + halo)
+        out[start:stop] = func(values[lo:hi])[start - lo:stop - lo]
+    return out
+
+
+def hampel_filter(values, window, n_sigma):
+    # 标准 Hampel 尺度: 窗口内各点与中心点窗口中位数 m_i 之差的中位数, 即 median_j |x_j - m_i|;
+    # 两端用 NaN 填充, 与居中滑动窗口 (min_periods=1) 的截断窗口一致。逐列计算以限制内存
+    half = window // 2
+    values = np.asarray(values, dtype=float)
+    out = values.copy()
+    for col in range(values.shape[1]):
+        padded = np.pad(values[:, col], half, constant_values=np.nan)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # 全为 NaN 的窗口
+            median = np.nanmedian(windows, axis=1)
+            mad = np.nanmedian(np.abs(windows - median[:, None]), axis=1)
+        outliers = np.abs(values[:, col] - median) > n_sigma * 1.4826 * mad
+        out[outliers, col] = median[outliers]
+    return out
+
+
+def smooth_values(values, method, window, polyorder):
+    from scipy.signal import savgol_filter
+    if method == 'moving_average':
+        return pd.DataFrame(values).rolling(window, center=True, min_periods=1).mean().to_numpy()
+    window = min(window, len(values) if len(values) % 2 else len(values) - 1)
+    if window <= polyorder: return values
+    return savgol_filter(values, window, polyorder, axis=0, mode='interp')
+
+
+def resample_uniform(df, signal_cols, time_col, rate):
+    from scipy.interpolate import interp1d
+    data = df.dropna(subset=[time_col]).sort_values(time_col).drop_duplicates(subset=[time_col])
+    t = data[time_col].to_numpy(dtype=float)
+    if len(t) < 2: return df
+    step = 1.0 / rate if rate else float(np.median(np.diff(t)))
+    new_t = np.arange(t[0], t[-1] + step / 2, step)
+    values = interp1d(t, data[signal_cols].to_numpy(dtype=float), axis=0, bounds_error=False,
+                      fill_value='extrapolate')(new_t)
+    out = pd.DataFrame(values, columns=signal_cols)
+    out.insert(0, time_col, new_t)
+    return out
+
+
+def apply_preprocess_step(df, step, time_col):
+    # 所有操作对全部传感器列一次性向量化执行, 时间列不参与滤波
+    signal_cols = [c for c in df.select_dtypes(include=np.number).columns if c != time_col]
+    op = step['op']
+    if op == 'resample':
+        return resample_uniform(df, signal_cols, time_col, step.get('rate'))
+    out = df.copy()
+    values = out[signal_cols].to_numpy(dtype=float)
+    if op == 'interpolate':
+        out[signal_cols] = out[signal_cols].interpolate(limit_direction='both')
+    elif op == 'hampel':
+        out[signal_cols] = apply_chunked(values, lambda v: hampel_filter(v, step['window'], step['n_sigma']),
+                                         halo=step['window'])
+    elif op == 'smooth':
+        out[signal_cols] = apply_chunked(
+            values, lambda v: smooth_values(v, step['method'], step['window'], step.get('polyorder', 2)),
+            halo=step['window'])
+    return out
+
+
+def run_preprocessing(original_json, spec):
+    # 按 (文件内容, 流水线前缀) 缓存每一步的中间结果;
+    # 修改某一步时从最长的已缓存前缀继续, 只重算该步及其后续步骤
+    time_col = (spec or {}).get('time_col')
+    steps = (spec or {}).get('steps', [])
+    file_key = hashlib.sha1(original_json.encode('utf-8')).hexdigest()
+    step_keys = [json.dumps(step, sort_keys=True) for step in steps]
+    keys = [(file_key, time_col, tuple(step_keys[:i])) for i in range(len(steps) + 1)]
+
+    # 每个键只读取一次: 两次读取之间条目可能被其他线程/worker 淘汰;
+    # 原始数据只由 frame_cache 缓存, 不在此重复保存
+    df, start = None, 0
+    for i in range(len(steps), 0, -1):
+        df = preprocess_cache.get(keys[i])
+        if df is not None:
+            start = i
+            break
+    if df is None:
+        df = read_frame(original_json)
+    for i in range(start, len(steps)):
+        df = apply_preprocess_step(df, steps[i], time_col).reset_index(drop=True)
+        preprocess_cache.set(keys[i + 1], df)
+    return df
+
+
+# --- 多文件传感器漂移补偿 ---
+DRIFT_MAX_VERSIONS = 10
+
+drift_model_cache = ResultCache('drift', maxsize=16)
+
+
+def fit_drift_model(labeled_data, reference_label, method, n_components, file_order):
+    # 用参考气体样本 (某一标签) 在多个文件中的响应拟合漂移模型; 文件按上传顺序视为时间顺序
+    ref = [item for item in labeled_data if item['label'] == reference_label]
+    if len({len(item['data']) for item in ref}) > 1:
+        raise ValueError("参考样本的数据维度不一致")
+    X_ref = np.array([item['data'] for item in ref], dtype=float)
+    ref_files = [item['file'] for item in ref]
+    positions = np.array([file_order.index(f) if f in file_order else len(file_order) for f in ref_files])
+
+    key = (hash_arrays(X_ref, positions), reference_label, method, n_components)
+    cached = drift_model_cache.get(key)
+    if cached is not None: return cached
+
+    model = {'method': method, 'reference_label': reference_label, 'n_samples': len(X_ref),
+             'files': sorted(set(ref_files), key=ref_files.index)}
+    if method == 'component':
+        # 成分校正: 在标准化空间中找到参考样本的主要变化方向, 视为漂移方向并从所有样本中去除
+        if len(X_ref) <= n_components:
+            raise ValueError(f"成分校正至少需要 {n_components + 1} 个参考样本")
+        mean = X_ref.mean(axis=0)
+        scale = X_ref.std(axis=0)
+        scale[scale == 0] = 1.0
+        from sklearn.decomposition import PCA
+        pca = PCA(n_components=n_components).fit((X_ref - mean) / scale)
+        model.update(mean=mean.tolist(), scale=scale.tolist(), components=pca.components_.tolist(),
+                     explained=pca.explained_variance_ratio_.tolist())
+    else:
+        # 乘性校正: 各文件参考响应相对最早文件的逐传感器比值, 再沿文件顺序做线性趋势拟合
+        file_positions = dict(zip(ref_files, positions))
+        fit_files = sorted(file_positions, key=file_positions.get)
+        if len(fit_files) < 2:
+            raise ValueError("乘性校正需要至少来自 2 个文件的参考样本")
+        ref_files = np.array(ref_files)
+        file_means = np.array([X_ref[ref_files == f].mean(axis=0) for f in fit_files])
+        base = np.where(np.abs(file_means[0]) < 1e-9, 1e-9, file_means[0])
+        factors = file_means / base
+        slope, intercept = np.polyfit(np.array([file_positions[f] for f in fit_files], dtype=float), factors, 1)
+        model.update(factors={f: factors[i].tolist() for i, f in enumerate(fit_files)},
+                     slope=slope.tolist(), intercept=intercept.tolist())
+
+    model['version'] = f"v{time.strftime('%Y%m%d-%H%M%S')}-{hashlib.sha1(repr(key).encode()).hexdigest()[:6]}"
+    drift_model_cache.set(key, model)
+    return model
+
+
+def apply_drift_model(X, files, model, file_order):
+    # 一次性对所有文件的样本做向量化校正; 拟合之后新上传的文件同样适用
+    X = np.asarray(X, dtype=float)
+    if model['method'] == 'component':
+        mean, scale = np.array(model['mean']), np.array(model['scale'])
+        P = np.array(model['components'])
+        Z = (X - mean) / scale
+        Z -= (Z @ P.T) @ P
+        return Z * scale + mean
+    slope, intercept = np.array(model['slope']), np.array(model['intercept'])
+    factor_rows = {}
+    for f in set(files):
+        if f in model['factors']:
+            factor_rows[f] = np.array(model['factors'][f])
+        else:
+            # 未参与拟合的文件 (含新文件) 按文件顺序在趋势线上插值/外推
+            position = file_order.index(f) if f in file_order else len(file_order)
+            factor_rows[f] = slope * position + intercept
+    F = np.array([factor_rows[f] for f in files])
+    return X / np.where(np.abs(F) < 1e-9, 1e-9, F)
+
+
+def active_drift_model(drift_store, drift_version, drift_enabled, n_features):
+    if not drift_enabled or not drift_store or not drift_version: return None
+    model = next((m for m in drift_store.get('versions', []) if m['version'] == drift_version), None)
+    if model is None or len(model.get('mean', model.get('slope', []))) != n_features: return None
+    return model
+
+
+def labeled_feature_matrix(df_labeled, drift_store, drift_version, drift_enabled, file_order):
+    X = np.array(df_labeled['data'].tolist())
+    model = active_drift_model(drift_store, drift_version, drift_enabled, X.shape[1])
+    if model is None: return X
+    return apply_drift_model(X, df_labeled['file'].tolist(), model, file_order or [])
+
+
+# --- 批量导出 (校准后记录 / 样本特征 / 投影与模型得分) ---
+EXPORT_CHUNK_ROWS = 50000
+EXPORT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+EXPORT_MAX_AGE_S = 24 * 3600  # 暂存的导出文件保留时长
+EXPORT_ROOT_ENV = 'ENOSE_EXPORT_ROOT'  # 允许 "写入本地目录" 的根目录 (--export-root)
+EXPORT_FORMATS = {'csv.gz': 'CSV (gzip)'}
+# Parquet / Feather 依赖可选的 pyarrow
+if importlib.util.find_spec('pyarrow') is not None:
+    EXPORT_FORMATS.update({'parquet': 'Parquet', 'feather': 'Feather'})
+local_dir_export = False  # 以本机单用户模式启动时置为 True
+
+
+def export_root():
+    # 多 worker 部署时放在共享缓存目录下, 任一 worker 都能提供下载
+    return os.path.join(os.environ.get(CACHE_DIR_ENV) or tempfile.gettempdir(), 'enose-exports')
+
+
+def cleanup_old_exports():
+    root = export_root()
+    if not os.path.isdir(root): return
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        # 多个 worker 共享该目录, 其他 worker 可能已删除同一过期目录
+        try:
+            if time.time() - os.path.getmtime(path) > EXPORT_MAX_AGE_S:
+                shutil.rmtree(path)
+        except OSError:
+            continue
+
+
+def resolve_export_dir(path):
+    # 目录由浏览器端填写; 配置了根目录时只能写入其下, 未配置时仅本机单用户模式可写任意目录
+    root = os.environ.get(EXPORT_ROOT_ENV)
+    if root:
+        root = os.path.realpath(root)
+        target = os.path.realpath(os.path.join(root, os.path.expanduser(path)))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"导出目录必须位于 {root} 之下")
+        return target
+    if not local_dir_export:
+        raise ValueError("多用户部署时需通过 --export-root 指定允许写入的目录")
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def safe_export_name(filename):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r'[^\w\-.]+', '_', stem) or 'file'
+
+
+def write_frame_chunked(df, path, fmt, transform=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    # 按块转换并写出, 任一时刻只有一块数据处于序列化状态
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    chunks = (df.iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows))
+    if transform is not None:
+        chunks = (transform(chunk) for chunk in chunks)
+    if fmt == 'csv.gz':
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+            header = True
+            for chunk in chunks:
+                chunk.to_csv(f, index=False, header=header)
+                header = False
+            if header: df.iloc[:0].to_csv(f, index=False)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer, schema = None, None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema) if fmt == 'parquet' else pa.ipc.new_file(path, schema)
+            writer.write_table(table)
+        if writer is None:
+            table = pa.Table.from_pandas(df.iloc[:0], preserve_index=False)
+            writer = pq.ParquetWriter(path, table.schema) if fmt == 'parquet' else pa.ipc.new_file(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None: writer.close()
+
+
+def export_recording(filename, file_entry, position, dest_dir, fmt, drift_model, file_order):
+    # 不经过 read_frame, 避免导出的每个完整记录都留在 frame_cache 中
+    df = pd.read_json(file_entry['processed'], orient='split')
+    numeric_cols = df.select_dtypes(include=np.number).columns
+    transform = None
+    if drift_model is not None and len(numeric_cols) == len(drift_model.get('mean', drift_model.get('slope', []))):
+        def transform(chunk):
+            chunk = chunk.copy()
+            chunk[numeric_cols] = apply_drift_model(chunk[numeric_cols].to_numpy(), [filename] * len(chunk),
+                                                    drift_model, file_order)
+            return chunk
+
+    rel_path = f"recordings/{position:03d}_{safe_export_name(filename)}.{fmt}"
+    write_frame_chunked(df, os.path.join(dest_dir, rel_path), fmt, transform)
+    return filename, {'path': rel_path, 'rows': len(df), 'columns': [str(c) for c in df.columns],
+                      'calibration': file_entry.get('calibration', {'applied': False}),
+                      'preprocess': file_entry.get('preprocess'), 'drift_corrected': transform is not None}
+
+
+def export_labeled_tables(labeled_data, files_data, dest_dir, fmt, analysis, drift_model, file_order, contents):
+    # 每个表单独捕获异常并写入元数据, 一个表失败不影响其余内容的导出
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.svm import SVC
+    df_labeled = pd.DataFrame(labeled_data)
+    if df_labeled['data'].apply(len).nunique() > 1:
+        error = {'error': "标记的数据维度不一致"}
+        return {'model': error, **{key: error for key in ('features', 'scores') if key in contents}}
+    X = np.array(df_labeled['data'].tolist(), dtype=float)
+    if drift_model is not None:
+        X = apply_drift_model(X, df_labeled['file'].tolist(), drift_model, file_order)
+    info = pd.DataFrame({'original_index': df_labeled['index'], 'label': df_labeled['label'],
+                         'source_file': df_labeled['file']})
+    le = LabelEncoder()
+    y_encoded = le.fit_transform(df_labeled['label'])
+
+    # 缩放器与投影参数总是写入元数据, 与是否导出得分表无关
+    projection = None
+    try:
+        projection = compute_projection(X, y_encoded, analysis['scaling_method'], analysis['projection_method'],
+                                        analysis['n_components'])
+        meta = {'model': projection['params']}
+    except Exception as e:
+        meta = {'model': {'error': str(e)}}
+
+    if 'features' in contents:
+        try:
+            first_file = df_labeled['file'].iloc[0]
+            feature_names = [f'feature_{i + 1}' for i in range(X.shape[1])]
+            if first_file in files_data:
+                cols = pd.read_json(files_data[first_file]['processed'], orient='split').select_dtypes(
+                    include=np.number).columns
+                if len(cols) == X.shape[1]: feature_names = [str(c) for c in cols]
+            features = pd.concat([info, pd.DataFrame(X, columns=feature_names)], axis=1)
+            write_frame_chunked(features, os.path.join(dest_dir, f'features.{fmt}'), fmt)
+            meta['features'] = {'path': f'features.{fmt}', 'rows': len(features), 'feature_names': feature_names}
+        except Exception as e:
+            meta['features'] = {'error': str(e)}
+
+    if 'scores' in contents:
+        if projection is None:
+            meta['scores'] = meta['model']
+            return meta
+        try:
+            prefix = PROJECTION_METHODS[analysis['projection_method']]['prefix']
+            scores = info.copy()
+            for i in range(analysis['n_components']):
+                scores[f'{prefix}{i + 1}'] = projection['embedding'][:, i]
+            svm_meta = None
+            if len(le.classes_) >= 2:
+                svm_params = {'kernel': analysis['svm_kernel'], 'C': analysis['svm_c'],
+                              'gamma': parse_svm_gamma(analysis['svm_gamma']), 'degree': analysis['svm_degree']}
+                model = SVC(**svm_params).fit(projection['embedding'], y_encoded)
+                decision = model.decision_function(projection['embedding'])
+                score_labels = le.classes_ if decision.ndim > 1 else le.classes_[1:]
+                for j, label in enumerate(score_labels):
+                    scores[f'svm_score_{label}'] = decision[:, j] if decision.ndim > 1 else decision
+                scores['svm_predicted_label'] = le.inverse_transform(model.predict(projection['embedding']))
+                svm_meta = dict(svm_params, classes=[str(c) for c in le.classes_])
+            write_frame_chunked(scores, os.path.join(dest_dir, f'scores.{fmt}'), fmt)
+            meta['scores'] = {'path': f'scores.{fmt}', 'rows': len(scores), 'svm': svm_meta}
+        except Exception as e:
+            meta['scores'] = {'error': str(e)}
+    return meta
+
+
+def run_bulk_export(dest_dir, fmt, contents, files_data, labeled_data, analysis, drift_model, file_order):
+    # 各文件的完整记录在线程池中并行写出; 元数据记录校准参数、缩放器与投影参数
+    os.makedirs(dest_dir, exist_ok=True)
+    metadata = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'format': fmt, 'contents': contents,
+                'analysis': analysis, 'drift_model': drift_model, 'files': {}}
+    if 'recordings' in contents and files_data:
+        order = [f for f in file_order if f in files_data] + [f for f in files_data if f not in file_order]
+        with ThreadPoolExecutor(max_workers=EXPORT_MAX_WORKERS) as pool:
+            futures = [pool.submit(export_recording, name, files_data[name], i, dest_dir, fmt, drift_model, file_order)
+                       for i, name in enumerate(order)]
+            for name, future in zip(order, futures):
+                try:
+                    metadata['files'][name] = future.result()[1]
+                except Exception as e:
+                    metadata['files'][name] = {'error': str(e)}
+    if labeled_data:
+        metadata.update(export_labeled_tables(labeled_data, files_data or {}, dest_dir, fmt, analysis, drift_model,
+                                              file_order, contents))
+    with open(os.path.join(dest_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+    return metadata
+
+
+def describe_export(metadata):
+    n_files = sum('path' in entry for entry in metadata['files'].values())
+    parts = [f"{n_files} 个文件的记录"] if n_files else []
+    parts += [name for key, name in (('features', '样本特征'), ('scores', '投影与得分'))
+              if 'path' in metadata.get(key, {})]
+    n_failed = sum('error' in entry for entry in metadata['files'].values()) + sum(
+        'error' in metadata.get(key, {}) for key in ('features', 'scores'))
+    status = "状态: 已导出 " + (", ".join(parts) if parts else "元数据")
+    return status + (f"\n{n_failed} 项导出失败, 原因见 metadata.json" if n_failed else "")
+
+
+def zip_directory(source_dir, zip_path, fmt):
+    # 逐个文件流式写入 zip; Parquet 与 CSV.gz 已压缩, 直接存储
+    compression = zipfile.ZIP_DEFLATED if fmt == 'feather' else zipfile.ZIP_STORED
+    with zipfile.ZipFile(zip_path, 'w', compression=compression, allowZip64=True) as zf:
+        for root, _, names in os.walk(source_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                zf.write(path, os.path.relpath(path, source_dir).replace(os.sep, '/'))
+
+
+# 通过 gunicorn 等直接加载模块时, 从环境变量启用共享缓存
+if os.environ.get(CACHE_DIR_ENV):
+    configure_shared_cache(os.environ[CACHE_DIR_ENV])
+mark_startup_phase('定义缓存与分析函数')
+
+
 # --- 初始化应用 ---
 app = dash.Dash(__name__, assets_folder=assets_path, suppress_callback_exceptions=True)
 server = app.server
 
+
+# 批量导出的 zip 文件由 Flask 从磁盘流式发送, 不经过 dcc.Download 的内存编码
+@server.route('/export/<token>/<path:filename>')
+def serve_export(token, filename):
+    if not re.fullmatch(r'[0-9a-f]{32}', token): flask.abort(404)
+    return flask.send_from_directory(os.path.join(export_root(), token), filename, as_attachment=True)
+
+
 # --- 自定义 Plotly 模板 ---
 custom_template = {
     "layout": go.Layout(
@@ -50,17 +899,22 @@ custom_template = {
         autosize=True,
     )
 }
+mark_startup_phase('创建 Dash 应用')
 
 # --- 应用布局 (已按要求重构) ---
 app.layout = html.Div(id="app-container", children=[
     # --- 后台数据存储 ---
     dcc.Store(id='uploaded-files-store', data={}),
     dcc.Store(id='active-file-store', data=None),
+    dcc.Store(id='file-order-store', data=[]),
+    dcc.Store(id='drift-model-store', data={'versions': []}),
     dcc.Store(id='labeled-data-store', data=[]),
     dcc.Store(id='temp-label-info-store', data={}),
     dcc.Store(id='interaction-mode-store', data='none'),  # 'none', 'labeling', 'baseline'
+    dcc.Store(id='preprocess-store', data={'time_col': None, 'steps': []}),
     dcc.Store(id='calibration-store', data={'applied': False}),
     dcc.Store(id='baseline-points-store', data=[]),
+    dcc.Store(id='ml-prewarm-store', data=False),
     dcc.Download(id="download-pca-data"),
 
     # --- 页面结构 ---
@@ -89,7 +943,49 @@ app.layout = html.Div(id="app-container", children=[
                                 html.Div(id='uploaded-files-list', className='files-list-container')
                             ]),
                             html.Div(className="control-card", children=[
-                                html.H3("2. 基线校准 (针对活动文件)"),
+                                html.H3("2. 数据预处理 (校准前执行)"),
+                                dcc.Checklist(
+                                    id='preprocess-steps-checklist',
+                                    options=[{'label': ' 缺失值插值 (NaN)', 'value': 'interpolate'},
+                                             {'label': ' Hampel 尖峰滤波', 'value': 'hampel'},
+                                             {'label': ' 重采样至均匀速率', 'value': 'resample'},
+                                             {'label': ' 平滑', 'value': 'smooth'}],
+                                    value=[], labelStyle={'display': 'block'}
+                                ),
+                                html.Div(className="control-group", style={'marginTop': '10px'}, children=[
+                                    html.Label("Hampel 窗口 / 阈值 (σ):"),
+                                    dcc.Input(id="preprocess-hampel-window", type="number", value=7, min=3, step=2,
+                                              className="half-width"),
+                                    dcc.Input(id="preprocess-hampel-sigma", type="number", value=3, min=0.5, step=0.5,
+                                              className="half-width"),
+                                ]),
+                                html.Div(className="control-group", children=[
+                                    html.Label("时间列 / 采样率 (留空取中位间隔):"),
+                                    dcc.Dropdown(id='preprocess-time-col', placeholder="时间列",
+                                                 className="half-width"),
+                                    dcc.Input(id="preprocess-resample-rate", type="number", min=0, placeholder="点/单位时间",
+                                              className="half-width"),
+                                ]),
+                                html.Div(className="control-group", children=[
+                                    html.Label("平滑方法 / 窗口 / 阶数:"),
+                                    dcc.Dropdown(
+                                        id='preprocess-smooth-method',
+                                        options=[{'label': 'Savitzky-Golay', 'value': 'savgol'},
+                                                 {'label': '滑动平均', 'value': 'moving_average'}],
+                                        value='savgol', clearable=False, style={'flex': '2'}
+                                    ),
+                                    dcc.Input(id="preprocess-smooth-window", type="number", value=11, min=3, step=2,
+                                              style={'flex': '1'}),
+                                    dcc.Input(id="preprocess-smooth-polyorder", type="number", value=2, min=0, step=1,
+                                              style={'flex': '1'}),
+                                ]),
+                                html.Button("应用预处理", id="apply-preprocess-button", n_clicks=0),
+                                html.Div(id='preprocess-status',
+                                         style={'marginTop': '15px', 'fontSize': '0.85em', 'color': '#007bff',
+                                                'whiteSpace': 'pre-wrap'})
+                            ]),
+                            html.Div(className="control-card", children=[
+                                html.H3("3. 基线校准 (针对活动文件)"),
                                 # *** 修改点：调整了此处的样式以修复下拉框宽度问题 ***
                                 html.Div(className="control-group", children=[
                                     html.Label("校准算法:", style={'flex-basis': 'auto', 'align-self': 'center',
@@ -180,6 +1076,13 @@ app.layout = html.Div(id="app-container", children=[
                                              {'label': ' 归一化 (Normalization)', 'value': 'minmax'}],
                                     value='standard', labelStyle={'display': 'block'}
                                 ),
+                                html.Label("投影方法:", style={'marginTop': '15px'}),
+                                dcc.Dropdown(
+                                    id='projection-method-select',
+                                    options=[{'label': info['label'], 'value': key}
+                                             for key, info in PROJECTION_METHODS.items()],
+                                    value='pca', clearable=False
+                                ),
                                 html.Label("降维维度:", style={'marginTop': '15px'}),
                                 dcc.RadioItems(
                                     id='pca-dimension-radio',
@@ -187,10 +1090,26 @@ app.layout = html.Div(id="app-container", children=[
                                              {'label': ' 3D', 'value': 3}],
                                     value=2, labelStyle={'display': 'inline-block', 'marginRight': '20px'}
                                 ),
+                                html.Label("显示模式:", style={'marginTop': '15px'}),
+                                dcc.RadioItems(
+                                    id='pca-render-mode-radio',
+                                    options=[{'label': ' 自动', 'value': 'auto'},
+                                             {'label': ' 散点', 'value': 'points'},
+                                             {'label': ' 密度图 (仅 2D)', 'value': 'density'}],
+                                    value='auto', labelStyle={'display': 'inline-block', 'marginRight': '20px'}
+                                ),
+                                html.Div(className="control-group", style={'marginTop': '10px'}, children=[
+                                    html.Label("每类最多显示点数:", className="half-width"),
+                                    dcc.Input(id="pca-max-display-input", type="number", min=1, step=1,
+                                              placeholder="留空显示全部", className="half-width"),
+                                ]),
                                 html.Button("生成/更新 PCA 图", id="generate-pca-button", n_clicks=0,
                                             style={'marginTop': '10px'}),
                                 html.Button("下载PCA数据", id="btn-download-pca", n_clicks=0, className="btn-secondary",
                                             style={'marginTop': '10px'}),
+                                html.Div(id='projection-scree-info',
+                                         style={'marginTop': '15px', 'fontSize': '0.8em', 'color': '#666',
+                                                'whiteSpace': 'pre-wrap'})
                             ]),
                             html.Div(className="control-card", children=[
                                 html.H3("2. SVM 决策边界"),
@@ -224,6 +1143,61 @@ app.layout = html.Div(id="app-container", children=[
                                          style={'marginTop': '15px', 'fontSize': '0.8em', 'color': '#666',
                                                 'backgroundColor': '#f0f0f0', 'padding': '8px', 'borderRadius': '4px'})
                             ]),
+                            html.Div(className="control-card", children=[
+                                html.H3("3. 传感器漂移补偿 (多文件)"),
+                                html.Label("参考气体标签:"),
+                                dcc.Dropdown(id='drift-reference-label', placeholder="选择作为参考的标签..."),
+                                html.Label("补偿方法:", style={'marginTop': '15px'}),
+                                dcc.RadioItems(
+                                    id='drift-method-radio',
+                                    options=[{'label': ' 成分校正 (去除漂移方向)', 'value': 'component'},
+                                             {'label': ' 逐传感器乘性校正', 'value': 'multiplicative'}],
+                                    value='component', labelStyle={'display': 'block'}
+                                ),
+                                html.Div(className="control-group", style={'marginTop': '10px'}, children=[
+                                    html.Label("漂移成分数:", className="half-width"),
+                                    dcc.Input(id="drift-n-components", type="number", value=1, min=1, step=1,
+                                              className="half-width"),
+                                ]),
+                                html.Button("拟合漂移模型", id="fit-drift-button", n_clicks=0),
+                                html.Label("模型版本:", style={'marginTop': '15px'}),
+                                dcc.Dropdown(id='drift-version-select', placeholder="尚未拟合模型"),
+                                dcc.Checklist(id='drift-apply-checklist',
+                                              options=[{'label': ' 在 PCA/SVM 与导出中应用漂移补偿', 'value': 'apply'}],
+                                              value=[], style={'marginTop': '10px'}),
+                                html.Div(id='drift-status',
+                                         style={'marginTop': '15px', 'fontSize': '0.85em', 'color': '#007bff',
+                                                'whiteSpace': 'pre-wrap'})
+                            ]),
+                            html.Div(className="control-card", children=[
+                                html.H3("4. 批量导出"),
+                                dcc.Checklist(
+                                    id='export-contents-checklist',
+                                    options=[{'label': ' 全部文件的校准后完整记录', 'value': 'recordings'},
+                                             {'label': ' 标记样本特征', 'value': 'features'},
+                                             {'label': ' 投影坐标与 SVM 得分', 'value': 'scores'}],
+                                    value=['recordings', 'features', 'scores'], labelStyle={'display': 'block'}
+                                ),
+                                html.Label("文件格式:", style={'marginTop': '15px'}),
+                                dcc.Dropdown(
+                                    id='export-format-select',
+                                    options=[{'label': label, 'value': key} for key, label in EXPORT_FORMATS.items()],
+                                    value='parquet' if 'parquet' in EXPORT_FORMATS else 'csv.gz', clearable=False
+                                ),
+                                html.Label("导出位置:", style={'marginTop': '15px'}),
+                                dcc.RadioItems(
+                                    id='export-destination-radio',
+                                    options=[{'label': ' 下载 ZIP', 'value': 'zip'},
+                                             {'label': ' 写入本地目录', 'value': 'dir'}],
+                                    value='zip', labelStyle={'display': 'inline-block', 'marginRight': '20px'}
+                                ),
+                                dcc.Input(id='export-dir-input', type='text', placeholder="本地目录路径 (仅写入本地目录时使用)",
+                                          style={'marginTop': '10px'}),
+                                html.Button("开始批量导出", id="btn-bulk-export", n_clicks=0, style={'marginTop': '10px'}),
+                                html.Div(id='export-status',
+                                         style={'marginTop': '15px', 'fontSize': '0.85em', 'color': '#007bff',
+                                                'whiteSpace': 'pre-wrap'})
+                            ]),
                         ])
                     ]),
             ]),
@@ -242,6 +1216,7 @@ app.layout = html.Div(id="app-container", children=[
         ]),
     ]),
 ])
+mark_startup_phase('构建页面布局')
 
 
 # --- 回调函数 (无需修改) ---
@@ -288,16 +1263,17 @@ def handle_file_upload(list_of_contents, list_of_names, existing_files_data):
 @app.callback(
     [Output('file-selector-dropdown', 'options'),
      Output('file-selector-dropdown', 'value'),
-     Output('file-selector-dropdown', 'disabled')],
+     Output('file-selector-dropdown', 'disabled'),
+     Output('file-order-store', 'data')],
     Input('uploaded-files-store', 'data'),
     State('active-file-store', 'data')
 )
 def update_file_selector(files_data, active_file):
-    if not files_data: return [], None, True
+    if not files_data: return [], None, True, []
     filenames = list(files_data.keys())
     options = [{'label': name, 'value': name} for name in filenames]
     current_active = active_file if active_file in filenames else filenames[0]
-    return options, current_active, False
+    return options, current_active, False, filenames
 
 
 # 3. 切换活动文件 (并重置校准状态)
@@ -391,21 +1367,38 @@ def update_calibration_store(btn_constant, btn_linear, btn_reset, btn_clear, sta
 
 # 6. 应用高级基线校准到数据
 @app.callback(
-    Output('uploaded-files-store', 'data', allow_duplicate=True),
-    [Input('calibration-store', 'data')],
+    [Output('uploaded-files-store', 'data', allow_duplicate=True),
+     Output('preprocess-status', 'children', allow_duplicate=True)],
+    [Input('calibration-store', 'data'), Input('preprocess-store', 'data')],
     [State('active-file-store', 'data'), State('uploaded-files-store', 'data')],
     prevent_initial_call=True
 )
-def apply_advanced_calibration(calib_params, active_file, files_data):
-    if not active_file or active_file not in files_data: return no_update
+def apply_advanced_calibration(calib_params, preprocess_spec, active_file, files_data):
+    if not active_file or active_file not in files_data: return no_update, no_update
 
     files_data_copy = copy.deepcopy(files_data)
-    original_df = pd.read_json(files_data_copy[active_file]['original'], orient='split')
+    has_preprocess = bool(preprocess_spec and preprocess_spec.get('steps'))
+    # 记录该文件当前的预处理与校准参数, 供批量导出写入元数据
+    files_data_copy[active_file]['calibration'] = calib_params or {'applied': False}
+    files_data_copy[active_file]['preprocess'] = preprocess_spec
 
-    if not calib_params or not calib_params.get('applied'):
+    if not has_preprocess and (not calib_params or not calib_params.get('applied')):
         # 如果取消校准，则恢复原始数据
         files_data_copy[active_file]['processed'] = files_data_copy[active_file]['original']
-        return files_data_copy
+        return files_data_copy, no_update
+
+    try:
+        # 预处理结果按 (文件, 流水线) 缓存, 校准在预处理后的数据上进行
+        original_df = run_preprocessing(files_data_copy[active_file]['original'], preprocess_spec)
+    except Exception as e:
+        print(f"Error during preprocessing: {e}")
+        return no_update, f"错误: 预处理失败\n{e}"
+    preprocess_status = "状态: 已应用预处理\n流程: " + " → ".join(
+        PREPROCESS_STEP_NAMES[step['op']] for step in preprocess_spec['steps']) if has_preprocess else no_update
+
+    if not calib_params or not calib_params.get('applied'):
+        files_data_copy[active_file]['processed'] = original_df.to_json(orient='split')
+        return files_data_copy, preprocess_status
 
     temp_data = original_df.copy()
     method = calib_params.get('method', 'div')
@@ -450,9 +1443,9 @@ def apply_advanced_calibration(calib_params, active_file, files_data):
         files_data_copy[active_file]['processed'] = temp_data.to_json(orient='split')
     except Exception as e:
         print(f"Error during advanced calibration: {e}")
-        return no_update
+        return no_update, f"错误: 校准失败\n{e}"
 
-    return files_data_copy
+    return files_data_copy, preprocess_status
 
 
 # 7. 处理图表点击 (合并了标签和基线选点)
@@ -476,7 +1469,7 @@ def handle_graph_click_combined(clickData, mode, active_file, files_data, temp_i
         if not temp_info: temp_info = {'file': active_file, 'points': []}
         if index in {p['index'] for p in temp_info['points']}: return no_update, no_update
 
-        df = pd.read_json(files_data[active_file]['processed'], orient='split')
+        df = read_frame(files_data[active_file]['processed'])
         if index < len(df):
             numeric_cols = df.select_dtypes(include=np.number).columns
             temp_info['points'].append({'index': index, 'data': df.loc[index, numeric_cols].tolist()})
@@ -533,7 +1526,7 @@ def update_timeseries_plot(active_file, files_data, labeled_data, temp_info, bas
         return fig
 
     # 始终从 'processed' 读取数据进行显示
-    df = pd.read_json(files_data[active_file]['processed'], orient='split')
+    df = read_frame(files_data[active_file]['processed'])
     fig = px.line(df, x=df.index, y=df.select_dtypes(include=np.number).columns, template=custom_template)
 
     # 绘制已保存的标签
@@ -579,14 +1572,19 @@ def update_labeled_data_list(labeled_data):
 
 # 12. 生成PCA图和SVM边界
 @app.callback(
-    Output('pca-plot', 'figure'),
+    [Output('pca-plot', 'figure'), Output('projection-scree-info', 'children')],
     [Input('generate-pca-button', 'n_clicks'), Input('draw-svm-button', 'n_clicks')],
     [State('labeled-data-store', 'data'), State('pca-scaling-method-radio', 'value'),
-     State('pca-dimension-radio', 'value'), State('svm-kernel-select', 'value'),
-     State('svm-c-input', 'value'), State('svm-gamma-input', 'value'), State('svm-degree-input', 'value')]
+     State('projection-method-select', 'value'),
+     State('pca-dimension-radio', 'value'), State('pca-render-mode-radio', 'value'),
+     State('pca-max-display-input', 'value'), State('svm-kernel-select', 'value'),
+     State('svm-c-input', 'value'), State('svm-gamma-input', 'value'), State('svm-degree-input', 'value'),
+     State('drift-model-store', 'data'), State('drift-version-select', 'value'),
+     State('drift-apply-checklist', 'value'), State('file-order-store', 'data')]
 )
-def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_components, svm_kernel, svm_c, svm_gamma,
-                    svm_degree):
+def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, projection_method, n_components, render_mode,
+                    max_display, svm_kernel, svm_c, svm_gamma, svm_degree, drift_store, drift_version, drift_apply,
+                    file_order):
     ctx = callback_context
     trigger_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else 'initial load'
 
@@ -595,7 +1593,10 @@ def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_comp
         fig.update_layout(title="PCA 与 SVM", annotations=[
             {"text": "请先标记至少一个数据点", "xref": "paper", "yref": "paper", "showarrow": False,
              "font": {"size": 16}}])
-        return fig
+        return fig, ""
+    # 页面首次加载时走上面的分支, 不会触发 scikit-learn 导入
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.svm import SVC
 
     df_labeled = pd.DataFrame(labeled_data)
     if df_labeled['data'].apply(len).nunique() > 1:
@@ -603,9 +1604,9 @@ def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_comp
         fig.update_layout(title="PCA 错误", annotations=[
             {"text": "错误：标记的数据维度不一致！\n请清除标签后重新标记。", "xref": "paper", "yref": "paper",
              "showarrow": False, "font": {"size": 16, "color": "red"}}])
-        return fig
+        return fig, ""
 
-    X = np.array(df_labeled['data'].tolist())
+    X = labeled_feature_matrix(df_labeled, drift_store, drift_version, 'apply' in (drift_apply or []), file_order)
     labels = df_labeled['label']
     le = LabelEncoder()
     y_encoded = le.fit_transform(labels)
@@ -625,32 +1626,60 @@ def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_comp
         fig.update_layout(title="PCA 与 SVM", annotations=[
             {"text": f"请标记至少 {n_components} 个数据点以进行 {n_components}D PCA", "xref": "paper", "yref": "paper",
              "showarrow": False, "font": {"size": 16}}])
-        return fig
+        return fig, ""
 
-    scaler = StandardScaler() if scaling_method == 'standard' else MinMaxScaler()
-    X_scaled = scaler.fit_transform(X)
-    pca = PCA(n_components=n_components)
-    X_pca = pca.fit_transform(X_scaled)
+    try:
+        projection = compute_projection(X, y_encoded, scaling_method, projection_method, n_components)
+    except ValueError as e:
+        fig = go.Figure(layout=custom_template)
+        fig.update_layout(title="投影错误", annotations=[
+            {"text": str(e), "xref": "paper", "yref": "paper", "showarrow": False,
+             "font": {"size": 16, "color": "red"}}])
+        return fig, ""
+    X_pca = projection['embedding']
+    explained = projection['explained_variance_ratio']
+    method_title = PROJECTION_METHODS[projection_method]['title']
+    scree_info = format_scree_info(projection_method, explained)
+
+    # 显示层面的抽样/密度渲染; SVM 始终使用全部点训练
+    n_points = len(X_pca)
+    use_density = n_components == 2 and (
+            render_mode == 'density' or (render_mode == 'auto' and n_points > DENSITY_POINT_THRESHOLD))
+    display_idx = None
+    if max_display:
+        display_idx = subsample_per_class(y_encoded, int(max_display))
+    elif n_components == 3 and render_mode == 'auto' and n_points > DENSITY_POINT_THRESHOLD:
+        display_idx = subsample_per_class(y_encoded, max(1, DENSITY_POINT_THRESHOLD // num_labels))
+    if use_density:
+        scree_info += f"\n显示: 密度图 ({n_points} 个点, SVM 使用全部点)"
+    elif display_idx is not None and len(display_idx) < n_points:
+        scree_info += f"\n显示: 抽样 {len(display_idx)} / {n_points} 个点 (SVM 使用全部点)"
+    X_display = X_pca if display_idx is None else X_pca[display_idx]
+    labels_display = labels.to_numpy() if display_idx is None else labels.to_numpy()[display_idx]
+    large_display = len(X_display) > WEBGL_POINT_THRESHOLD
+    marker_style = dict(size=5) if large_display else dict(size=12, line=dict(width=1, color='DarkSlateGrey'))
 
     if n_components == 2:
-        pca_df = pd.DataFrame(data=X_pca, columns=['PC1', 'PC2'])
-        pca_df['label'] = labels
-        fig = px.scatter(pca_df, x='PC1', y='PC2', color='label', color_discrete_map=color_map, title="2D PCA 降维结果",
-                         labels={'PC1': f'主成分 1 ({pca.explained_variance_ratio_[0]:.1%})',
-                                 'PC2': f'主成分 2 ({pca.explained_variance_ratio_[1]:.1%})'}, template=custom_template)
-        fig.update_traces(marker=dict(size=12, line=dict(width=1, color='DarkSlateGrey')))
+        axis_labels = projection_axis_labels(projection_method, explained, 2, verbose=True)
+        if use_density:
+            fig = go.Figure(data=build_density_traces(X_pca, labels, color_map), layout=custom_template)
+            fig.update_layout(title=f"2D {method_title} 降维结果 (密度)", xaxis_title=axis_labels['PC1'],
+                              yaxis_title=axis_labels['PC2'], legend_title_text='label')
+        else:
+            pca_df = pd.DataFrame(data=X_display, columns=['PC1', 'PC2'])
+            pca_df['label'] = labels_display
+            fig = px.scatter(pca_df, x='PC1', y='PC2', color='label', color_discrete_map=color_map,
+                             title=f"2D {method_title} 降维结果", labels=axis_labels, template=custom_template,
+                             render_mode='webgl' if large_display else 'svg')
+            fig.update_traces(marker=marker_style)
 
         if trigger_id == 'draw-svm-button' and len(unique_labels) >= 2:
-            try:
-                gamma_val = float(svm_gamma)
-            except (ValueError, TypeError):
-                gamma_val = svm_gamma
-            model = SVC(kernel=svm_kernel, C=svm_c, gamma=gamma_val, degree=svm_degree, probability=True).fit(X_pca,
-                                                                                                              y_encoded)
-            x_min, x_max = X_pca[:, 0].min() - 1, X_pca[:, 0].max() + 1
-            y_min, y_max = X_pca[:, 1].min() - 1, X_pca[:, 1].max() + 1
-            xx, yy = np.meshgrid(np.arange(x_min, x_max, 0.05), np.arange(y_min, y_max, 0.05))
-            Z = model.predict(np.c_[xx.ravel(), yy.ravel()]).reshape(xx.shape)
+            gamma_val = parse_svm_gamma(svm_gamma)
+            model = SVC(kernel=svm_kernel, C=svm_c, gamma=gamma_val, degree=svm_degree).fit(X_pca, y_encoded)
+            # 网格步长由数据范围决定, 非线性嵌入 (t-SNE/UMAP/LDA) 的坐标范围远大于标准化 PCA
+            lo, hi = X_pca.min(axis=0) - 1, X_pca.max(axis=0) + 1
+            xx, yy = np.meshgrid(np.linspace(lo[0], hi[0], SVM_MESH_2D_RES), np.linspace(lo[1], hi[1], SVM_MESH_2D_RES))
+            Z = predict_in_chunks(model, np.c_[xx.ravel(), yy.ravel()]).reshape(xx.shape)
 
             unique_z = np.unique(Z)
             colors_for_z = [color_sequence[i % len(color_sequence)] for i in unique_z]
@@ -664,17 +1693,17 @@ def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_comp
                                        zmin=np.min(y_encoded), zmax=np.max(y_encoded))
             fig.add_trace(contour_trace)
             fig.data = (fig.data[-1],) + fig.data[:-1]
-            fig.update_layout(title_text=f"2D PCA with {svm_kernel.upper()} SVM Boundary")
+            fig.update_layout(title_text=f"2D {method_title} with {svm_kernel.upper()} SVM Boundary")
     else:
-        pca_df = pd.DataFrame(data=X_pca, columns=['PC1', 'PC2', 'PC3'])
-        pca_df['label'] = labels
+        pca_df = pd.DataFrame(data=X_display, columns=['PC1', 'PC2', 'PC3'])
+        pca_df['label'] = labels_display
         fig = px.scatter_3d(pca_df, x='PC1', y='PC2', z='PC3', color='label', color_discrete_map=color_map,
-                            title="3D PCA 降维结果",
-                            labels={'PC1': f'PC1 ({pca.explained_variance_ratio_[0]:.1%})',
-                                    'PC2': f'PC2 ({pca.explained_variance_ratio_[1]:.1%})',
-                                    'PC3': f'PC3 ({pca.explained_variance_ratio_[2]:.1%})'}, template=custom_template)
-        fig.update_traces(marker=dict(size=8, line=dict(width=1, color='DarkSlateGrey')))
+                            title=f"3D {method_title} 降维结果",
+                            labels=projection_axis_labels(projection_method, explained, 3), template=custom_template)
+        fig.update_traces(marker=dict(size=3) if large_display else dict(size=8, line=dict(width=1,
+                                                                                           color='DarkSlateGrey')))
         if trigger_id == 'draw-svm-button' and len(unique_labels) == 2 and svm_kernel == 'linear':
+            # 线性二分类: 直接绘制解析的分类平面
             try:
                 model = SVC(kernel='linear', C=svm_c).fit(X_pca, y_encoded)
                 w, b = model.coef_[0], model.intercept_[0]
@@ -687,10 +1716,20 @@ def update_pca_plot(pca_clicks, svm_clicks, labeled_data, scaling_method, n_comp
                     fig.add_trace(go.Surface(x=xx, y=yy, z=zz,
                                              colorscale=[[0, 'rgba(0,123,255,0.5)'], [1, 'rgba(0,123,255,0.5)']],
                                              showscale=False, name='SVM Plane', hoverinfo='none'))
-                    fig.update_layout(title_text="3D PCA with Linear SVM Plane")
+                    fig.update_layout(title_text=f"3D {method_title} with Linear SVM Plane")
             except Exception as e:
                 print(f"Error drawing 3D SVM plane: {e}")
-    return fig
+        elif trigger_id == 'draw-svm-button' and len(unique_labels) >= 2:
+            # 多分类或非线性核: 在有界网格上分块评估模型并绘制各类别决策区域
+            try:
+                volume = compute_svm_volume(X_pca, y_encoded, svm_kernel, svm_c, parse_svm_gamma(svm_gamma),
+                                            svm_degree)
+                fig.add_traces(build_svm_volume_traces(volume, unique_labels, color_sequence))
+                fig.update_layout(title_text=f"3D {method_title} with {svm_kernel.upper()} SVM Regions")
+                scree_info += f"\nSVM 决策区域网格: {volume['resolution']}³"
+            except Exception as e:
+                print(f"Error drawing 3D SVM regions: {e}")
+    return fig, scree_info
 
 
 # 13. 按钮禁用状态管理
@@ -750,25 +1789,32 @@ def toggle_svm_params(kernel):
     Output("download-pca-data", "data"),
     Input("btn-download-pca", "n_clicks"),
     [State('labeled-data-store', 'data'), State('pca-scaling-method-radio', 'value'),
-     State('pca-dimension-radio', 'value')],
+     State('projection-method-select', 'value'), State('pca-dimension-radio', 'value'),
+     State('drift-model-store', 'data'), State('drift-version-select', 'value'),
+     State('drift-apply-checklist', 'value'), State('file-order-store', 'data')],
     prevent_initial_call=True
 )
-def download_pca_data(n_clicks, labeled_data, scaling_method, n_components):
+def download_pca_data(n_clicks, labeled_data, scaling_method, projection_method, n_components, drift_store,
+                      drift_version, drift_apply, file_order):
     if not n_clicks or not labeled_data: return no_update
     df_labeled = pd.DataFrame(labeled_data)
     if df_labeled['data'].apply(len).nunique() > 1: return no_update
-    X = np.array(df_labeled['data'].tolist())
+    X = labeled_feature_matrix(df_labeled, drift_store, drift_version, 'apply' in (drift_apply or []), file_order)
     if X.shape[0] < n_components: return no_update
 
-    scaler = StandardScaler() if scaling_method == 'standard' else MinMaxScaler()
-    X_scaled = scaler.fit_transform(X)
-    pca = PCA(n_components=n_components)
-    X_pca = pca.fit_transform(X_scaled)
+    # 与绘图共用同一缓存, 刚生成过投影时无需重新拟合
+    from sklearn.preprocessing import LabelEncoder
+    y_encoded = LabelEncoder().fit_transform(df_labeled['label'])
+    try:
+        X_pca = compute_projection(X, y_encoded, scaling_method, projection_method, n_components)['embedding']
+    except ValueError:
+        return no_update
 
+    prefix = PROJECTION_METHODS[projection_method]['prefix']
     download_df = pd.DataFrame(
         {'original_index': df_labeled['index'], 'label': df_labeled['label'], 'source_file': df_labeled['file']})
     for i in range(n_components):
-        download_df[f'PC{i + 1}'] = X_pca[:, i]
+        download_df[f'{prefix}{i + 1}'] = X_pca[:, i]
     return dcc.send_data_frame(download_df.to_csv, "pca_results.csv", index=False)
 
 
@@ -781,53 +1827,269 @@ def update_svm_warning(n_components, svm_kernel, labeled_data):
     if not labeled_data: return "请先标记数据。"
     unique_labels = pd.DataFrame(labeled_data)['label'].nunique()
     if unique_labels < 2: return "注意：SVM边界需要至少两个不同的标签才能生成。"
-    if n_components == 3 and svm_kernel != 'linear':
-        return f"注意：3D模式下，SVM决策边界可视化仅支持'线性核'{'和2个标签' if unique_labels > 2 else ''}。"
+    if n_components == 3 and (svm_kernel != 'linear' or unique_labels > 2):
+        return "注意：3D模式下将在有界网格上评估SVM，并以半透明曲面显示各类别的决策区域；网格分辨率随时间预算和类别数自动调整。"
     if unique_labels > 2 and svm_kernel == 'linear': return "注意：'线性核'SVM通常用于二分类问题。"
     return "SVM参数已就绪。"
 
 
+# 19. 更新预处理参数存储
+@app.callback(
+    [Output('preprocess-store', 'data'), Output('preprocess-status', 'children')],
+    Input('apply-preprocess-button', 'n_clicks'),
+    [State('preprocess-steps-checklist', 'value'), State('preprocess-hampel-window', 'value'),
+     State('preprocess-hampel-sigma', 'value'), State('preprocess-time-col', 'value'),
+     State('preprocess-resample-rate', 'value'), State('preprocess-smooth-method', 'value'),
+     State('preprocess-smooth-window', 'value'), State('preprocess-smooth-polyorder', 'value')],
+    prevent_initial_call=True
+)
+def update_preprocess_store(n_clicks, selected_steps, hampel_window, hampel_sigma, time_col, resample_rate,
+                            smooth_method, smooth_window, smooth_polyorder):
+    selected_steps = selected_steps or []
+    if 'resample' in selected_steps and not time_col:
+        return no_update, "错误: 重采样需要先选择时间列"
+    if 'smooth' in selected_steps and smooth_method == 'savgol' and (smooth_window or 0) <= (smooth_polyorder or 0):
+        return no_update, "错误: Savitzky-Golay 窗口必须大于多项式阶数"
+
+    # 滑动窗口统一取奇数, 保证居中对称
+    def odd(value, default):
+        value = int(value or default)
+        return value if value % 2 else value + 1
+
+    steps = []
+    for op in PREPROCESS_ORDER:
+        if op not in selected_steps: continue
+        if op == 'interpolate':
+            steps.append({'op': op})
+        elif op == 'hampel':
+            steps.append({'op': op, 'window': odd(hampel_window, 7), 'n_sigma': float(hampel_sigma or 3)})
+        elif op == 'resample':
+            steps.append({'op': op, 'rate': float(resample_rate) if resample_rate else None})
+        elif op == 'smooth':
+            steps.append({'op': op, 'method': smooth_method, 'window': odd(smooth_window, 11),
+                          'polyorder': int(smooth_polyorder or 0)})
+    if not steps:
+        return {'time_col': time_col, 'steps': []}, "状态: 未启用预处理"
+    # 流水线在回调 6 中执行, 完成或失败后由其更新状态
+    return {'time_col': time_col, 'steps': steps}, \
+        "状态: 正在应用预处理...\n流程: " + " → ".join(PREPROCESS_STEP_NAMES[step['op']] for step in steps)
+
+
+# 20. 更新预处理时间列选项
+@app.callback(
+    Output('preprocess-time-col', 'options'),
+    Input('active-file-store', 'data'),
+    State('uploaded-files-store', 'data')
+)
+def update_preprocess_time_col_options(active_file, files_data):
+    if not active_file or not files_data or active_file not in files_data: return []
+    df = run_preprocessing(files_data[active_file]['original'], None)
+    return [{'label': col, 'value': col} for col in df.select_dtypes(include=np.number).columns]
+
+
+# 21. 更新漂移参考标签选项
+@app.callback(
+    Output('drift-reference-label', 'options'),
+    Input('labeled-data-store', 'data')
+)
+def update_drift_reference_options(labeled_data):
+    if not labeled_data: return []
+    return [{'label': label, 'value': label} for label in sorted({item['label'] for item in labeled_data})]
+
+
+# 22. 拟合漂移模型 (保留最近的若干个版本)
+@app.callback(
+    [Output('drift-model-store', 'data'), Output('drift-status', 'children')],
+    Input('fit-drift-button', 'n_clicks'),
+    [State('labeled-data-store', 'data'), State('drift-reference-label', 'value'),
+     State('drift-method-radio', 'value'), State('drift-n-components', 'value'),
+     State('file-order-store', 'data'), State('drift-model-store', 'data')],
+    prevent_initial_call=True
+)
+def fit_drift_model_callback(n_clicks, labeled_data, reference_label, method, n_components, file_order, drift_store):
+    if not labeled_data or not reference_label:
+        return no_update, "错误: 请先选择参考气体标签"
+    try:
+        model = fit_drift_model(labeled_data, reference_label, method, int(n_components or 1), file_order or [])
+    except ValueError as e:
+        return no_update, f"错误: {e}"
+    versions = [m for m in (drift_store or {}).get('versions', []) if m['version'] != model['version']]
+    versions = (versions + [model])[-DRIFT_MAX_VERSIONS:]
+    method_name = '成分校正' if method == 'component' else '乘性校正'
+    return {'versions': versions}, (f"状态: 已拟合漂移模型 {model['version']}\n方法: {method_name}\n"
+                                    f"参考样本: {model['n_samples']} 个, 来自 {len(model['files'])} 个文件")
+
+
+# 23. 更新漂移模型版本列表 (默认选中最新版本)
+@app.callback(
+    [Output('drift-version-select', 'options'), Output('drift-version-select', 'value')],
+    Input('drift-model-store', 'data')
+)
+def update_drift_version_options(drift_store):
+    versions = (drift_store or {}).get('versions', [])
+    if not versions: return [], None
+    options = [{'label': f"{m['version']} ({m['reference_label']})", 'value': m['version']} for m in reversed(versions)]
+    return options, versions[-1]['version']
+
+
+# 24. 首次打开分析标签页时在后台预热机器学习模块
+@app.callback(
+    Output('ml-prewarm-store', 'data'),
+    Input('control-panel-tabs', 'value'),
+    prevent_initial_call=True
+)
+def prewarm_ml_stack(tab_value):
+    if tab_value != 'tab-analysis': return no_update
+    prewarm_modules('ml', ML_STACK_MODULES)
+    return True
+
+
+# 25. 批量导出
+@app.callback(
+    Output('export-status', 'children'),
+    Input('btn-bulk-export', 'n_clicks'),
+    [State('export-contents-checklist', 'value'), State('export-format-select', 'value'),
+     State('export-destination-radio', 'value'), State('export-dir-input', 'value'),
+     State('uploaded-files-store', 'data'), State('labeled-data-store', 'data'), State('file-order-store', 'data'),
+     State('pca-scaling-method-radio', 'value'), State('projection-method-select', 'value'),
+     State('pca-dimension-radio', 'value'), State('svm-kernel-select', 'value'), State('svm-c-input', 'value'),
+     State('svm-gamma-input', 'value'), State('svm-degree-input', 'value'), State('drift-model-store', 'data'),
+     State('drift-version-select', 'value'), State('drift-apply-checklist', 'value')],
+    prevent_initial_call=True
+)
+def bulk_export(n_clicks, contents, fmt, destination, export_dir, files_data, labeled_data, file_order,
+                scaling_method, projection_method, n_components, svm_kernel, svm_c, svm_gamma, svm_degree,
+                drift_store, drift_version, drift_apply):
+    contents = contents or []
+    if not contents: return "错误: 请至少选择一项导出内容"
+    if not files_data and not labeled_data: return "错误: 没有可导出的数据"
+    if destination == 'dir' and not export_dir: return "错误: 请填写本地导出目录"
+
+    n_features = len(labeled_data[0]['data']) if labeled_data else None
+    drift_model = None
+    if n_features is not None:
+        drift_model = active_drift_model(drift_store, drift_version, 'apply' in (drift_apply or []), n_features)
+    analysis = {'scaling_method': scaling_method, 'projection_method': projection_method,
+                'n_components': n_components, 'svm_kernel': svm_kernel, 'svm_c': svm_c, 'svm_gamma': svm_gamma,
+                'svm_degree': svm_degree}
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+
+    try:
+        if destination == 'dir':
+            dest_dir = os.path.join(resolve_export_dir(export_dir), f'enose_export_{stamp}')
+            metadata = run_bulk_export(dest_dir, fmt, contents, files_data, labeled_data, analysis, drift_model,
+                                       file_order or [])
+            return f"{describe_export(metadata)}\n目录: {dest_dir}"
+
+        cleanup_old_exports()
+        token = uuid.uuid4().hex
+        staging_dir = os.path.join(export_root(), token)
+        data_dir = os.path.join(staging_dir, 'data')
+        metadata = run_bulk_export(data_dir, fmt, contents, files_data, labeled_data, analysis, drift_model,
+                                   file_order or [])
+        zip_name = f'enose_export_{stamp}.zip'
+        zip_directory(data_dir, os.path.join(staging_dir, zip_name), fmt)
+        shutil.rmtree(data_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"Error during bulk export: {e}")
+        return f"错误: 导出失败 ({e})"
+    return [f"{describe_export(metadata)}\n", html.A(f"⬇ 下载 {zip_name}", href=f"/export/{token}/{zip_name}")]
+
+
+mark_startup_phase('注册回调')
+
+
+# --- 启动计时与浏览器 ---
+def report_startup_time(label, breakdown=False):
+    elapsed = time.perf_counter() - STARTUP_T0
+    status = "达标" if elapsed <= COLD_START_TARGET_S else "超出目标"
+    print(f"{label}: {elapsed:.2f}s (目标 {COLD_START_TARGET_S:.1f}s, {status})")
+    if breakdown:
+        # 每个阶段的耗时为与上一个标记之间的间隔
+        previous = STARTUP_T0
+        for name, t in STARTUP_PHASES:
+            print(f"  {t - previous:6.2f}s  {name}")
+            previous = t
+    return elapsed
+
+
+def open_browser_when_ready(host, port, exit_after=False, timeout=30):
+    # 服务端口可连接后立即打开浏览器, 代替固定的延时等待
+    def wait_and_open():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((host, port), timeout=0.2):
+                    break
+            except OSError:
+                time.sleep(0.05)
+        mark_startup_phase('启动服务器并绑定端口')
+        elapsed = report_startup_time("冷启动耗时", breakdown=exit_after)
+        if exit_after:
+            os._exit(0 if elapsed <= COLD_START_TARGET_S else 1)
+        webbrowser.open_new(f"http://{host}:{port}")
+
+    threading.Thread(target=wait_and_open, name='open-browser', daemon=True).start()
+
+
+# --- 多用户部署 ---
+def run_production_server(host, port, workers, cache_dir):
+    # 每位用户的数据都保存在各自浏览器会话的 dcc.Store 中, 回调本身无状态;
+    # 服务端缓存按内容哈希索引, 因此多个 worker 可安全共享同一缓存目录
+    os.environ[CACHE_DIR_ENV] = cache_dir
+    configure_shared_cache(cache_dir)
+    # 服务器模式不在意冷启动, 在 fork worker 之前一次性导入全部模块
+    prewarm_modules('data', DATA_STACK_MODULES, background=False)
+    prewarm_modules('ml', ML_STACK_MODULES, background=False)
+    if os.name != 'nt' and importlib.util.find_spec('gunicorn') is not None:
+        from gunicorn.app.base import BaseApplication
+
+        class EnoseApplication(BaseApplication):
+            def load_config(self):
+                self.cfg.set('bind', f'{host}:{port}')
+                self.cfg.set('workers', workers)
+                self.cfg.set('timeout', 300)  # t-SNE/UMAP 等较慢的投影需要更长的请求超时
+
+            def load(self):
+                return server
+
+        EnoseApplication().run()
+    elif importlib.util.find_spec('waitress') is not None:
+        # Windows 或未安装 gunicorn 时使用 waitress (单进程多线程)
+        from waitress import serve
+        serve(server, host=host, port=port, threads=workers)
+    else:
+        hint = "pip install waitress" if os.name == 'nt' else "pip install gunicorn (或 pip install waitress)"
+        print(f"--serve 需要 gunicorn 或 waitress, 两者均未安装。请先运行: {hint}")
+        sys.exit(1)
+
+
 # --- 运行应用的主入口 ---
 if __name__ == "__main__":
-    HOST, PORT = '127.0.0.1', 8050
-    css_string = """
-    html, body { font-family: Segoe UI, sans-serif; background-color: #f8f9fa; margin: 0; padding: 0; }
-    #app-container { max-width: 1800px; margin: auto; padding: 20px; box-sizing: border-box; }
-    #header { text-align: center; margin-bottom: 20px; } #header h1 { color: #333; }
-    #main-content { display: flex; flex-direction: row; gap: 20px; align-items: flex-start; }
-    #control-panel { flex: 0 0 400px; background: white; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.05); padding: 0; }
-    #graph-container { flex: 1; display: flex; flex-direction: column; gap: 20px; }
-    .control-card { padding: 20px; padding-top: 0; }
-    .control-card:first-child { padding-top: 20px; }
-    .graph-card { background: white; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.05); padding: 20px; height: 450px; display: flex; flex-direction: column; }
-    .control-card h3, .graph-card h3 { margin-top: 0; border-bottom: 1px solid #eee; padding-bottom: 10px; margin-bottom: 15px; color: #343a40; }
-    .control-group { display: flex; gap: 10px; align-items: center; margin-bottom: 10px; flex-wrap: wrap; }
-    .control-group label { font-weight: bold; font-size: 0.9em; margin-bottom: 0; flex-basis: 100%; }
-    .control-group .half-width, .control-group > .Select, .control-group > input { flex: 1; min-width: 100px; }
-    input[type=number], input[type=text], .Select-control { width: 100%; padding: 8px; border: 1px solid #ccc; border-radius: 4px; box-sizing: border-box; }
-    #upload-data { border: 2px dashed #007bff; border-radius: 5px; padding: 20px; text-align: center; cursor: pointer; transition: background-color 0.2s; }
-    #upload-data:hover { background-color: #e9f5ff; }
-    #upload-text { color: #007bff; font-weight: bold; }
-    .files-list-container { margin-top: 15px; max-height: 150px; overflow-y: auto; border: 1px solid #eee; padding: 10px; border-radius: 4px; }
-    button { color: white; background-color: #007bff; border: none; padding: 10px 15px; border-radius: 4px; cursor: pointer; transition: background-color 0.2s; width: 100%; box-sizing: border-box; font-weight: bold; margin-top: 5px; }
-    button:hover:not(:disabled) { background-color: #0056b3; }
-    button:disabled { background-color: #ccc !important; color: #666 !important; cursor: not-allowed; }
-    button.btn-secondary { background-color: #6c757d; }
-    button.btn-secondary:hover:not(:disabled) { background-color: #5a6268; }
-    button.btn-danger { background-color: #dc3545; }
-    button.btn-danger:hover:not(:disabled) { background-color: #c82333; }
-    #labeling-interface { margin-top: 15px; border: 1px solid #ddd; padding: 15px; border-radius: 5px; background-color: #f9f9f9; }
-    .labeled-list { max-height: 200px; overflow-y: auto; border: 1px solid #e0e0e0; border-radius: 4px; }
-    .styled-table { width: 100%; border-collapse: collapse; }
-    .styled-table th, .styled-table td { padding: 8px 12px; border-bottom: 1px solid #eee; text-align: left; }
-    .styled-table th { background-color: #f8f9fa; font-size: 0.9em; }
-    .custom-tabs-container { border-bottom: 1px solid #dee2e6; }
-    .custom-tab { padding: 12px 16px; cursor: pointer; background-color: #f8f9fa; border: 1px solid transparent; border-top-left-radius: .25rem; border-top-right-radius: .25rem; color: #007bff; font-weight: 500; }
-    .custom-tab--selected { color: #495057; background-color: #fff; border-color: #dee2e6 #dee2e6 #fff; border-bottom: 1px solid #fff; position: relative; top: 1px; }
-    .tab-content { padding: 0; }
-    """
-    if not os.path.exists(assets_path): os.makedirs(assets_path)
-    with open(os.path.join(assets_path, "style.css"), "w", encoding="utf-8") as f:
-        f.write(css_string)
-    threading.Timer(1, lambda: webbrowser.open_new(f"http://{HOST}:{PORT}")).start()
-    app.run(host=HOST, port=PORT, debug=False)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="电子鼻数据分析与气味识别平台")
+    parser.add_argument('--serve', action='store_true', help="多用户部署模式 (gunicorn/waitress, 不打开浏览器)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--workers', type=int, default=4, help="worker 进程数 (waitress 下为线程数)")
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV) or
+                        os.path.join(tempfile.gettempdir(), 'enose-cache'), help="多个 worker 共享的缓存目录")
+    parser.add_argument('--export-root', default=os.environ.get(EXPORT_ROOT_ENV),
+                        help="批量导出 '写入本地目录' 允许的根目录 (多用户部署时必须指定才能使用该选项)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="测量冷启动耗时后退出 (超出目标时返回非零退出码)")
+    args = parser.parse_args()
+    HOST, PORT = args.host, args.port
+    if args.export_root:
+        os.environ[EXPORT_ROOT_ENV] = args.export_root
+    if args.serve:
+        run_production_server(HOST, PORT, args.workers, args.cache_dir)
+    else:
+        local_dir_export = True
+        report_startup_time("模块加载耗时")
+        open_browser_when_ready(HOST, PORT, exit_after=args.profile_startup)
+        if not args.profile_startup:
+            # 首次上传文件前在后台导入 pandas / plotly.express
+            prewarm_modules('data', DATA_STACK_MODULES)
+        app.run(host=HOST, port=PORT, debug=False)
\ No newline at end of file